@@ -2,13 +2,16 @@
 Generates a CLDF dataset for Nikolaev's "The database of Eurasian phonological inventories" (2020).
 """
 
+import os
 import json
+import pickle
+import functools
 import unicodedata
 from pathlib import Path
 from unidecode import unidecode
 
 from pyglottolog import Glottolog
-from pyclts import CLTS, models
+from pyclts import CLTS
 
 from cldfbench import CLDFSpec
 from cldfbench import Dataset as BaseDataset
@@ -17,30 +20,45 @@ from cldfcatalog.config import Config
 
 from tqdm import tqdm as progressbar
 from collections import defaultdict
+from itertools import chain
 from pycldf import Sources
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
+# Version of the fields stored in the Glottolog cache
+GLOTTOLOG_CACHE_VERSION = 1
+
+# Character replacements applied after Unicode normalization
+_GRAPHEME_TABLE = str.maketrans({
+    '\u2019': '\u02bc',  # RIGHT SINGLE QUOTATION MARK -> MODIFIER LETTER APOSTROPHE
+})
+
+
+@functools.lru_cache(maxsize=None)
 def compute_id(text):
     """
     Returns a codepoint representation to an Unicode string.
     """
 
-    unicode_repr = "".join(["u{0:0{1}X}".format(ord(char), 4) for char in text])
+    unicode_repr = "".join(map("u{:04X}".format, map(ord, text)))
 
     label = slug(unidecode(text))
 
     return "%s_%s" % (label, unicode_repr)
 
 
-
+@functools.lru_cache(maxsize=None)
 def normalize_grapheme(text):
     """
     Apply simple, non-CLTS, normalization.
     """
 
     new_text = unicodedata.normalize("NFD", text)
-    new_text = new_text.replace('\u2019', '\u02bc')
+    new_text = new_text.translate(_GRAPHEME_TABLE)
     return new_text
 
 
@@ -59,9 +77,44 @@ class Dataset(BaseDataset):
                 data_fnames={'ParameterTable': 'features.csv'}
             )
 
+    def glottolog_languages(self, args):
+        """
+        Return the LanguageTable fields of all Glottolog languoids by glottocode.
+
+        The mapping is pickled under `.cache`, keyed by the Glottolog version,
+        so that the Glottolog tree is only parsed once per release. Bump
+        `GLOTTOLOG_CACHE_VERSION` whenever the stored fields change.
+        """
+        cache_path = self.dir / ".cache" / "glottolog-v{0}-{1}.pkl".format(
+            GLOTTOLOG_CACHE_VERSION, args.glottolog.describe())
+        if cache_path.exists():
+            with open(cache_path, "rb") as handler:
+                return pickle.load(handler)
+
+        languages = {}
+        for lang in Glottolog(args.glottolog.dir).languoids():
+            languages[lang.id] = {
+                # Same as str(lang.family), without re-reading the ancestors
+                "Family": "{0} [{1}]".format(*lang.lineage[0][:2])
+                if lang.lineage else None,
+                "Glottocode": lang.id,
+                "ISO639P3code": lang.iso_code,
+                "Latitude": lang.latitude,
+                "Longitude": lang.longitude,
+                "Macroarea": lang.macroareas[0].name if lang.macroareas else None,
+                "Glottolog_Name": lang.name,
+            }
+        cache_path.parent.mkdir(exist_ok=True)
+        # Write to a temporary file first, so that an interrupted run cannot
+        # leave a truncated pickle behind
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+        with open(tmp_path, "wb") as handler:
+            pickle.dump(languages, handler)
+        os.replace(tmp_path, cache_path)
+        return languages
+
     def cmd_makecldf(self, args):
 
-        glottolog = Glottolog(args.glottolog.dir)
         clts = CLTS(Config.from_file().get_clone('clts'))
         bipa = clts.bipa
         clts_eurasian = clts.transcriptiondata_dict['eurasian']
@@ -80,77 +133,80 @@ class Dataset(BaseDataset):
         )
 
         # load language mapping and build inventory info
-        languages = []
+        languages = args.writer.objects["LanguageTable"]
         lang_map = {}
-        all_glottolog = {lng.id: lng for lng in glottolog.languoids()}
+        all_glottolog = self.glottolog_languages(args)
         unknowns = defaultdict(list)
         for row in progressbar(
-                self.etc_dir.read_csv( "languages.csv", dicts=True)):
-            lang_map[row["name"]] = slug(row["name"])
-            lang_dict = {"ID": slug(row["name"]), "Name": row["name"]}
+                self.etc_dir.read_csv("languages.csv", dicts=True)):
+            name = row["name"]
+            lang_id = lang_map[name] = slug(name)
+            lang_dict = {"ID": lang_id, "Name": name}
             if row["glottocode"] in all_glottolog:
-                lang = all_glottolog[row["glottocode"]]
-                lang_dict.update(
-                    {
-                        "Family": lang.family if lang.lineage else None,
-                        "Glottocode": lang.id,
-                        "ISO639P3code": lang.iso_code,
-                        "Latitude": lang.latitude,
-                        "Longitude": lang.longitude,
-                        "Macroarea": lang.macroareas[0].name if lang.macroareas else None,
-                        "Glottolog_Name": lang.name,
-                    }
-                )
+                lang_dict.update(all_glottolog[row["glottocode"]])
             languages.append(lang_dict)
 
 
         # Read raw data
-        with open(self.raw_dir.joinpath('phono_dbase.json').as_posix()) as handler:
-            raw_data = json.load(handler)
+        with open(self.raw_dir / 'phono_dbase.json', 'rb') as handler:
+            if orjson:
+                raw_data = orjson.loads(handler.read())
+            else:
+                raw_data = json.loads(handler.read().decode('utf-8'))
 
         # Iterate over raw data
-        values = []
-        parameters = []
-        inventories = []
+        parameters = {}
         counter = 1
-        segment_set = set()
-        with open(self.raw_dir.joinpath('sources.txt').as_posix()) as f:
+        with open(self.raw_dir / 'sources.txt') as f:
             sources = [source.strip() for source in f.readlines()][1:]
         sources_ = Sources.from_file(self.raw_dir / "sources.bib")
         args.writer.cldf.add_sources(*sources_)
+        # BIPA resolution is done once per distinct normalized grapheme
+        sound_cache = {}
+        # Local aliases for names looked up in the inner loop
+        values_append = args.writer.objects["ValueTable"].append
+        cache_get = sound_cache.get
+        _normalize = normalize_grapheme
+        _compute_id = compute_id
+        _gmap = clts_eurasian.grapheme_map
         for idx, (language, langdata) in enumerate(raw_data.items()):
             cons = langdata["cons"]
             vows = langdata["vows"]
-            tones = [tone for tone in langdata["tones"] if tone]
             source = sources[idx]
             # Prepare language key
             lang_key = language.split("#")[0].replace(",", "")
+            lang_id = lang_map[lang_key]
 
             # Add consonants and vowels to values, also collecting parameters
-            for segment in cons + vows:
-                marginal = bool(segment[0] == "(")
+            for segment in chain(cons, vows):
+                marginal = segment.startswith("(")
 
                 # Obtain the corresponding BIPA grapheme, is possible
-                normalized = normalize_grapheme(segment)
-                par_id = compute_id(normalized)
-                if normalized in clts_eurasian.grapheme_map:
-                    sound = bipa[clts_eurasian.grapheme_map[normalized]]
-                else:
-                    sound = bipa['<NA>']
+                normalized = _normalize(segment)
+                cached = cache_get(normalized)
+                if cached is None:
+                    par_id = _compute_id(normalized)
+                    known = normalized in _gmap
+                    if known:
+                        sound = bipa[_gmap[normalized]]
+                    else:
+                        sound = bipa['<NA>']
+                    if sound.type == 'unknownsound':
+                        bipa_grapheme = ''
+                        desc = ''
+                    else:
+                        bipa_grapheme = str(sound)
+                        desc = sound.name
+                    parameters[par_id] = (normalized, bipa_grapheme, desc)
+                    cached = sound_cache[normalized] = (par_id, known)
+                par_id, known = cached
+                if not known:
                     unknowns[normalized] += [(segment, lang_key)]
-                if sound.type == 'unknownsound':
-                    bipa_grapheme = ''
-                    desc = ''
-                else:
-                    bipa_grapheme = str(sound)
-                    desc = sound.name
-                parameters.append((par_id, normalized, bipa_grapheme, desc))
 
-
-                values.append(
+                values_append(
                     {
                         "ID": str(counter),
-                        "Language_ID": lang_map[lang_key],
+                        "Language_ID": lang_id,
                         "Marginal": marginal,
                         "Parameter_ID": par_id,
                         "Value": normalized,
@@ -160,19 +216,10 @@ class Dataset(BaseDataset):
                 )
                 counter += 1
 
-        # Build segment data
-        segments = [
+        # Build segment data; all tables are written when the writer is closed
+        args.writer.objects["ParameterTable"].extend(
             {"ID": id, "Name": normalized, "BIPA": bipa_grapheme, "Description": desc}
-            for id, normalized, bipa_grapheme, desc in set(parameters)
-        ]
-
-        # Write data and validate
-        args.writer.write(
-            **{
-                "ValueTable": values,
-                "LanguageTable": languages,
-                "ParameterTable": segments,
-            }
+            for id, (normalized, bipa_grapheme, desc) in parameters.items()
         )
         for g, rest in unknowns.items():
             print('\t'.join(
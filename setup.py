@@ -18,5 +18,8 @@ setup(
         'test': [
             'pytest-cldf',
         ],
+        'fast': [
+            'orjson',
+        ],
     },
 )